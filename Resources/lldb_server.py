@@ -6,34 +6,109 @@ import time
 import threading
 import signal
 import struct
+import math
+from collections import OrderedDict
 
 # Add the current directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from debug_logger import init_logger, log, log_error, log_crash, log_communication, log_python_server, log_lldb
 
+# JSON codec for the transport; _dumps returns UTF-8 encoded bytes
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    _encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+    def _dumps(j):
+        return _encode(j).encode("utf-8")
+    _loads = json.loads
+
+# 4-byte little-endian length header framing every message on the pipe
+_LEN_STRUCT = struct.Struct('<I')
+
+# Maximum number of bytes pulled from the input pipe per read
+_RX_CHUNK_SIZE = 65536
+
+# Cap on frames (events and responses) gathered into one write when draining pipelined requests
+_MAX_BATCH_FRAMES = 16
+
+# Pure queries whose responses may wait for the next pipelined request; anything that moves
+# the process or raises an event is flushed as soon as it is handled
+_BATCHABLE_COMMANDS = frozenset(("getRegisters", "disassembly", "readMemory"))
+
+def _isBatchable(req):
+    return isinstance(req, dict) and req.get("command") in _BATCHABLE_COMMANDS
+
+# Per-message transport, request and stepping logs are only formatted when MACDBG_VERBOSE=1
+_VERBOSE = os.environ.get('MACDBG_VERBOSE', '0') == '1'
+
+# Byte -> printable character table for the memory dump ASCII column
+_ASCII_TABLE = bytes(c if 32 <= c < 127 else 0x2e for c in range(256))
+
+# Process states in which a step or halt is still in flight
+_RUNNING_STATES = (lldb.eStateRunning, lldb.eStateStepping)
+_ATTACHING_STATES = (lldb.eStateAttaching,)
+
+# Pre-baked "stopped" event; reasons are fixed identifiers that need no JSON escaping
+_STOP_EVENT_TEMPLATE = '{"type":"stopped","payload":{"reason":"%s","pc":%d,"thread_id":%d}}'
+
+# General purpose registers reported by getRegisters unless a detailed dump is requested
+_GPR_X86_64 = ('rax', 'rbx', 'rcx', 'rdx', 'rdi', 'rsi', 'rbp', 'rsp',
+               'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15',
+               'rip', 'rflags', 'cs', 'fs', 'gs')
+_GPR_ARM64 = tuple(f'x{i}' for i in range(29)) + ('fp', 'lr', 'sp', 'pc', 'cpsr')
+_GPR_I386 = ('eax', 'ebx', 'ecx', 'edx', 'edi', 'esi', 'ebp', 'esp', 'eip', 'eflags')
+_GPR_NAMES = {
+    'x86_64': _GPR_X86_64,
+    'x86_64h': _GPR_X86_64,
+    'arm64': _GPR_ARM64,
+    'arm64e': _GPR_ARM64,
+    'aarch64': _GPR_ARM64,
+    'i386': _GPR_I386,
+}
+
+# Install locations of macOS system libraries and frameworks
+_SYSTEM_LIBRARY_PREFIXES = ('/System/', '/usr/lib/')
+
+# Filename prefixes of core runtime libraries, for modules whose directory is unknown
+_SYSTEM_LIBRARY_NAMES = ('libsystem', 'libdispatch', 'libobjc', 'libc++')
+
+# Number of (process, stop, address, count, module epoch) disassembly results kept around
+_DISASM_CACHE_SIZE = 128
+
 class EventThread(threading.Thread):
     def __init__(self, handler):
         super().__init__(daemon=True)
         self.handler = handler
         self.running = True
+        self.shutdownBroadcaster = lldb.SBBroadcaster("macdbg.eventthread.shutdown")
+
+    def requestStop(self):
+        """Ask the thread to exit, waking it out of its listener wait"""
+        self.running = False
+        self.shutdownBroadcaster.BroadcastEventByType(1)
 
     def run(self):
         log_python_server("EventThread started")
+        listener = self.handler.debugger.GetListener()
+        self.shutdownBroadcaster.AddListener(listener, 1)
+        event = lldb.SBEvent()
         while self.running:
             try:
-                if self.handler.target and self.handler.target.GetProcess():
-                    process = self.handler.target.GetProcess()
-                    if process.IsValid():
-                        # Check for events
-                        event = lldb.SBEvent()
-                        if self.handler.debugger.GetListener().GetNextEvent(event):
-                            log_python_server(f"Event received: {event.GetType()}")
-                            # Don't send generic stopped events - let the stepping methods handle their own events
-                            # This prevents interference with proper stepping events that include PC information
-                time.sleep(0.1)
+                # Block until LLDB delivers an event; requestStop() wakes the wait through the shutdown broadcaster
+                if not listener.WaitForEvent(60, event):
+                    continue
+                if _VERBOSE:
+                    log_python_server(f"Event received: {event.GetType()}")
+                if lldb.SBTarget.EventIsTargetEvent(event) and event.GetType() & (lldb.SBTarget.eBroadcastBitModulesLoaded | lldb.SBTarget.eBroadcastBitModulesUnloaded):
+                    self.handler.onModulesChanged()
+                # Don't send generic stopped events - let the stepping methods handle their own events
+                # This prevents interference with proper stepping events that include PC information
             except Exception as e:
+                # The debugger listener is also the process's primary listener, so this thread must
+                # keep draining it; one bad event must not stall every later state change
                 log_error(f"Error in EventThread: {str(e)}", e)
-                break
         log_python_server("EventThread stopped")
 
 class Handler:
@@ -48,6 +123,43 @@ class Handler:
         self.logger = init_logger()
         self.is64Bits = True
         self.executable = None
+        self._rxbuf = bytearray()
+        self._rxchunk = bytearray(_RX_CHUNK_SIZE)
+        self._rxchunk_view = memoryview(self._rxchunk)
+        self._txhdr = bytearray(_LEN_STRUCT.size)
+        # Serializes frame writes (and use of _txhdr) so frames from different threads never interleave
+        self._txlock = threading.Lock()
+        # Event frames produced while handling a request; flushed together with its response
+        self._deferred = None
+        self._mod_epoch = 0
+        self._disasm_cache = OrderedDict()
+        # (process, stop ID, thread ID, detailed) and the getRegisters response built for it
+        self._reg_cache = None
+        # Module UUID -> whether it is a system library, see _isSystemModule
+        self._system_modules = {}
+        # Targets stay loaded across detach/attach, keyed by (executable, is64Bits)
+        self._targets = {}
+        # Dedicated listener for process state changes, so step waits don't race the EventThread
+        self._stateListener = lldb.SBListener("macdbg.state")
+        # command -> (method, ((request key, default), ...)) used by handleRequest
+        self._dispatch = {
+            "attachToProcess": (self.attachToProcess, (("pid", None), ("executable", None), ("is64Bits", True))),
+            "getRegisters": (self.getRegisters, (("detailed", False),)),
+            "disassembly": (self.disassembly, (("address", 0), ("count", 10))),
+            "readMemory": (self.readMemory, (("address", 0), ("length", 256))),
+            "writeByte": (self.writeByte, (("address", None), ("value", None))),
+            "writeBytes": (self.writeBytes, (("address", None), ("bytes", ""))),
+            "stepInstruction": (self.stepInstruction, ()),
+            "stepInto": (self.stepInto, ()),
+            "stepOver": (self.stepOver, ()),
+            "stepOut": (self.stepOut, ()),
+            "stepUntilUserCode": (self.stepUntilUserCode, ()),
+            "continueExecution": (self.continueExecution, ()),
+            "stopExecution": (self.stopExecution, ()),
+            "detach": (self.detach, ()),
+            "setBreakpoint": (self.setBreakpoint, (("address", None), ("type", "software"))),
+            "removeBreakpoint": (self.removeBreakpoint, (("id", None),)),
+        }
 
     def buildOK(self):
         return {"status": "ok"}
@@ -55,59 +167,125 @@ class Handler:
     def buildError(self, message):
         return {"status": "error", "message": message}
 
-    def sendEvent(self, event):
+    def onModulesChanged(self):
+        """Invalidate state derived from the target's module list"""
+        # Cached disassembly may now point at different code
+        self._mod_epoch += 1
+
+    def sendStopEvent(self, reason, pc, thread_id):
+        """Send a stopped event from the pre-baked template, skipping the JSON encoder"""
         try:
-            data = json.dumps(event).encode('utf-8')
-            length = struct.pack('<I', len(data))
-            os.write(self.output_fd, length + data)
-            log_communication("SENT", event)
+            data = (_STOP_EVENT_TEMPLATE % (reason, pc, thread_id)).encode('ascii')
+            self._queueFrame(data)
+            if _VERBOSE:
+                log_communication("SENT", data.decode('ascii'))
         except Exception as e:
             log_error(f"Failed to send event: {str(e)}", e)
 
+    def _nextFrame(self):
+        """Pop the next complete frame payload from the receive buffer, reading more as needed"""
+        buf = self._rxbuf
+        while True:
+            if len(buf) >= 4:
+                length = _LEN_STRUCT.unpack_from(buf, 0)[0]
+                end = 4 + length
+                if len(buf) >= end:
+                    if _VERBOSE:
+                        log_python_server(f"Message length: {length}")
+                    data = bytes(buf[4:end])
+                    del buf[:end]
+                    return data
+            # One read may bring in several queued requests; they stay buffered for later calls.
+            # Reading into the fixed scratch buffer avoids allocating a bytes object per read.
+            n = os.readv(self.input_fd, (self._rxchunk,))
+            if _VERBOSE:
+                log_python_server(f"Read {n} bytes")
+            if not n:
+                if buf:
+                    log_python_server(f"Incomplete message at EOF: {len(buf)} bytes buffered")
+                return None
+            buf += self._rxchunk_view[:n]
+
+    def _hasBufferedFrame(self):
+        """Whether a complete request is already sitting in the receive buffer"""
+        buf = self._rxbuf
+        return len(buf) >= 4 and len(buf) >= 4 + _LEN_STRUCT.unpack_from(buf, 0)[0]
+
     def transportRead(self):
         try:
-            log_python_server("Waiting for data from Swift...")
-            # Read 4-byte length header
-            length_data = os.read(self.input_fd, 4)
-            log_python_server(f"Read length data: {length_data.hex()}")
-            if len(length_data) != 4:
-                log_python_server(f"Invalid length data length: {len(length_data)}")
-                return None
-            length = struct.unpack('<I', length_data)[0]
-            log_python_server(f"Message length: {length}")
-            
-            # Read the actual data
-            data = os.read(self.input_fd, length)
-            log_python_server(f"Read data length: {len(data)}")
-            if len(data) != length:
-                log_python_server(f"Data length mismatch: expected {length}, got {len(data)}")
+            if _VERBOSE:
+                log_python_server("Waiting for data from Swift...")
+            data = self._nextFrame()
+            if data is None:
                 return None
                 
-            message = data.decode('utf-8')
-            log_communication("RECEIVED", message)
-            return json.loads(message)
+            if _VERBOSE:
+                log_communication("RECEIVED", data.decode('utf-8'))
+            return _loads(data)
         except Exception as e:
             log_error(f"Error reading transport: {str(e)}", e)
             return None
 
-    def transportWrite(self, s):
+    def transportWrite(self, data):
         try:
-            data = s.encode('utf-8')
-            length = struct.pack('<I', len(data))
-            os.write(self.output_fd, length + data)
+            self._writeFrame(data)
         except Exception as e:
             log_error(f"Error writing transport: {str(e)}", e)
 
+    def _queueFrame(self, data):
+        """Hold an event frame back while a request is being handled, else write it now"""
+        if self._deferred != None:
+            self._deferred.append(data)
+        else:
+            self._writeFrame(data)
+
+    def _writeFrames(self, frames):
+        """Write several length-prefixed frames with one gathered write"""
+        iov = []
+        for data in frames:
+            iov.append(_LEN_STRUCT.pack(len(data)))
+            iov.append(data)
+        total = sum(map(len, iov))
+        with self._txlock:
+            written = os.writev(self.output_fd, iov)
+            if written < total:
+                # Short pipe write: finish the remainder
+                rest = memoryview(b"".join(iov))[written:]
+                while rest:
+                    rest = rest[os.write(self.output_fd, rest):]
+
+    def _writeFrame(self, data):
+        """Write one length-prefixed frame, gathering header and payload without concatenating"""
+        with self._txlock:
+            header = self._txhdr
+            _LEN_STRUCT.pack_into(header, 0, len(data))
+            total = len(header) + len(data)
+            written = os.writev(self.output_fd, (header, data))
+            if written < total:
+                # Short pipe write: finish the remainder of the frame
+                rest = memoryview(bytes(header) + data)[written:]
+                while rest:
+                    rest = rest[os.write(self.output_fd, rest):]
+
     def attachToProcess(self, pid, executable, is64Bits):
         log_python_server(f"attachToProcess called: pid={pid}, executable={executable}, is64Bits={is64Bits}")
         
         try:
+            err = lldb.SBError()
             if self.target == None:
-                err = lldb.SBError()
                 self.is64Bits = is64Bits
                 self.executable = executable
-                log_python_server(f"Creating target for executable: {executable}")
-                self.target = self.debugger.CreateTargetWithFileAndArch(self.executable, lldb.LLDB_ARCH_DEFAULT_64BIT if self.is64Bits else lldb.LLDB_ARCH_DEFAULT_32BIT)
+                # Reuse the target left resident by an earlier session on the same binary
+                target_key = (executable, is64Bits)
+                target = self._targets.get(target_key)
+                if target != None and target.IsValid():
+                    log_python_server(f"Reusing target for executable: {executable}")
+                else:
+                    log_python_server(f"Creating target for executable: {executable}")
+                    target = self.debugger.CreateTargetWithFileAndArch(self.executable, lldb.LLDB_ARCH_DEFAULT_64BIT if self.is64Bits else lldb.LLDB_ARCH_DEFAULT_32BIT)
+                    if target != None and target.IsValid():
+                        self._targets[target_key] = target
+                self.target = target
             
             if self.target == None or not self.target.IsValid():
                 self.target = self.debugger.CreateTarget("")
@@ -119,17 +297,21 @@ class Handler:
             process = self.target.AttachToProcessWithID(self.debugger.GetListener(), pid, err)
             
             if process != None:
-                log_python_server(f"Attach successful, process state: {process.GetState()}")
-                # Initialize event thread if not already done
-                if self.eventThread is None:
+                log_python_server("Attach successful")
+                self.process = process
+                process.GetBroadcaster().AddListener(self._stateListener, lldb.SBProcess.eBroadcastBitStateChanged)
+                # The event thread only cares about module list changes from the target
+                self.target.GetBroadcaster().AddListener(self.debugger.GetListener(), lldb.SBTarget.eBroadcastBitModulesLoaded | lldb.SBTarget.eBroadcastBitModulesUnloaded)
+                # The event thread is long-lived; only start it the first time (or if it died)
+                if self.eventThread is None or not self.eventThread.is_alive():
                     log_python_server("Starting event thread")
                     self.eventThread = EventThread(self)
-                self.eventThread.start()
+                    self.eventThread.start()
                 
-                while process.GetState() == lldb.eStateAttaching:
-                    time.sleep(0.1)
+                # Attach has no time limit; wake on the state change rather than polling
+                state = self._waitForStop(process, None, _ATTACHING_STATES)
                 
-                log_python_server(f"Process state after attach: {process.GetState()}")
+                log_python_server(f"Process state after attach: {state}")
                 result = self.buildOK()
                 
                 if self.target.GetNumModules() > 0:
@@ -156,18 +338,28 @@ class Handler:
             log_crash(f"attachToProcess crashed: {str(e)}")
             return self.buildError(f"attachToProcess failed: {str(e)}")
 
-    def getRegisters(self):
+    def _threadContext(self):
+        """Resolve the process and its first thread once; returns (process, thread, error)"""
+        process = self.process
+        if process is None:
+            return None, None, self.buildError("no process")
+        if not process.IsValid():
+            return None, None, self.buildError("process not valid")
+        thread = process.GetThreadAtIndex(0)
+        if not thread.IsValid():
+            return process, None, self.buildError("no valid thread")
+        return process, thread, None
+
+    def getRegisters(self, detailed=False):
         try:
-            if self.target == None or self.target.GetProcess() == None:
-                return self.buildError("no process")
-            
-            process = self.target.GetProcess()
-            if not process.IsValid():
-                return self.buildError("process not valid")
+            process, thread, error = self._threadContext()
+            if error != None:
+                return error
             
-            thread = process.GetThreadAtIndex(0)
-            if not thread.IsValid():
-                return self.buildError("no valid thread")
+            # Registers can't change until the process runs and stops again, which bumps the stop ID
+            cache_key = (process.GetUniqueID(), process.GetStopID(), thread.GetThreadID(), detailed)
+            if self._reg_cache != None and self._reg_cache[0] == cache_key:
+                return self._reg_cache[1]
             
             frame = thread.GetFrameAtIndex(0)
             if not frame.IsValid():
@@ -175,25 +367,42 @@ class Handler:
             
             registers = {}
             
-            # Get register context from frame
-            reg_context = frame.GetRegisters()
-            
-            # Iterate through register sets (general purpose, floating point, etc.)
-            for reg_set_idx in range(reg_context.GetSize()):
-                reg_set = reg_context.GetValueAtIndex(reg_set_idx)
-                if reg_set.IsValid():
-                    # Iterate through registers in this set
-                    for reg_idx in range(reg_set.GetNumChildren()):
-                        reg = reg_set.GetChildAtIndex(reg_idx)
-                        if reg.IsValid():
+            # Fast path: look up just the general purpose registers for this architecture
+            names = None if detailed else _GPR_NAMES.get((self.target.GetTriple() or '').split('-', 1)[0])
+            if names != None:
+                for reg_name in names:
+                    reg = frame.FindRegister(reg_name)
+                    if reg.IsValid():
+                        reg_value = reg.GetValue()
+                        if reg_value:
+                            registers[reg_name] = reg_value
+            
+            if not registers:
+                # Get register context from frame
+                reg_context = frame.GetRegisters()
+                
+                # Iterate through register sets (general purpose, floating point, etc.);
+                # unless a detailed dump was asked for, only the first set, which LLDB orders as the GPRs
+                num_sets = reg_context.GetSize()
+                if not detailed:
+                    num_sets = min(num_sets, 1)
+                for reg_set_idx in range(num_sets):
+                    reg_set = reg_context.GetValueAtIndex(reg_set_idx)
+                    if reg_set.IsValid():
+                        # Iterate through registers in this set; children of a valid set are valid
+                        for reg_idx in range(reg_set.GetNumChildren()):
+                            reg = reg_set.GetChildAtIndex(reg_idx)
                             reg_name = reg.GetName()
                             reg_value = reg.GetValue()
                             if reg_name and reg_value:
                                 registers[reg_name] = reg_value
             
-            log_lldb(f"Retrieved {len(registers)} registers")
+            if _VERBOSE:
+                log_lldb(f"Retrieved {len(registers)} registers")
             # Send as proper message format expected by Swift
-            return {"type": "registers", "payload": {"registers": registers}}
+            result = {"type": "registers", "payload": {"registers": registers}}
+            self._reg_cache = (cache_key, result)
+            return result
         except Exception as e:
             log_error(f"Exception in getRegisters: {str(e)}", e)
             return self.buildError(f"getRegisters failed: {str(e)}")
@@ -210,111 +419,200 @@ class Handler:
                 else:
                     address = int(address)
             
-            log_lldb(f"Disassembling {count} instructions from 0x{address:x}")
+            process = self.process
+            if process is None or not process.IsValid():
+                return self.buildError("no valid process")
+            
+            # Keyed on the process so entries from an earlier session never match, and on the
+            # stop ID so code patched while running (or a dlopen racing the epoch bump) is re-read
+            cache_key = (process.GetUniqueID(), process.GetStopID(), address, count, self._mod_epoch)
+            cached = self._disasm_cache.get(cache_key)
+            if cached is not None:
+                self._disasm_cache.move_to_end(cache_key)
+                if _VERBOSE:
+                    log_lldb(f"Disassembly cache hit for 0x{address:x} ({count} instructions)")
+                return cached
+            
+            if _VERBOSE:
+                log_lldb(f"Disassembling {count} instructions from 0x{address:x}")
             
             # Create address object
             sb_address = lldb.SBAddress(address, self.target)
             if not sb_address.IsValid():
                 return self.buildError(f"invalid address: 0x{address:x}")
             
-            # Use LLDB command interpreter for disassembly - more reliable
-            process = self.target.GetProcess()
-            if not process or not process.IsValid():
-                return self.buildError("no valid process")
+            # Decode straight through the SB API; no CLI round trip or text parsing
+            target = self.target
+            insts = target.ReadInstructions(sb_address, count)
+            err = lldb.SBError()
+            lines = []
+            for i in range(insts.GetSize()):
+                ins = insts.GetInstructionAtIndex(i)
+                # Pull the opcode bytes out in one call and hex them in C rather than per byte
+                data = ins.GetData(target)
+                raw = data.ReadRawData(err, 0, data.GetByteSize())
+                lines.append({
+                    'address': ins.GetAddress().GetLoadAddress(target),
+                    'instruction': ins.GetMnemonic(target),
+                    'operands': ins.GetOperands(target),
+                    'bytes': raw.hex(' ') if raw else ""
+                })
             
-            # Use LLDB command interpreter to get disassembly
-            command_interpreter = self.debugger.GetCommandInterpreter()
-            command_result = lldb.SBCommandReturnObject()
+            if not lines:
+                return self.buildError("no valid disassembly lines found")
             
-            # Create disassembly command
-            disasm_cmd = f"disassemble --count {count} --start-address 0x{address:x}"
-            log_lldb(f"Executing LLDB command: {disasm_cmd}")
+            if _VERBOSE:
+                log_lldb(f"Successfully disassembled {len(lines)} instructions")
+            # Send as proper message format expected by Swift
+            result = {"type": "disassembly", "payload": {"lines": lines}}
+            self._disasm_cache[cache_key] = result
+            if len(self._disasm_cache) > _DISASM_CACHE_SIZE:
+                self._disasm_cache.popitem(last=False)
+            return result
+        except Exception as e:
+            log_error(f"Exception in disassembly: {str(e)}", e)
+            return self.buildError(f"disassembly failed: {str(e)}")
+
+    def readMemory(self, address, length):
+        try:
+            process = self.process
+            if process is None:
+                return self.buildError("no process")
+            if not process.IsValid():
+                return self.buildError("process not valid")
             
-            # Execute the command
-            command_interpreter.HandleCommand(disasm_cmd, command_result)
+            # Handle address parameter - could be string or int
+            if isinstance(address, str):
+                if address.startswith("0x"):
+                    address = int(address, 16)
+                else:
+                    address = int(address)
             
-            if not command_result.Succeeded():
-                return self.buildError(f"disassembly command failed: {command_result.GetError()}")
+            if _VERBOSE:
+                log_lldb(f"Reading {length} bytes from 0x{address:x}")
             
-            # Parse the output
-            output = command_result.GetOutput()
-            if not output:
-                return self.buildError("no disassembly output received")
+            err = lldb.SBError()
+            mem = process.ReadMemory(address, length, err)
+            if not err.Success() or mem is None:
+                return self.buildError(f"unable to read memory at 0x{address:x}")
             
-            log_lldb(f"Disassembly output: {output[:200]}...")
+            # Format 16 bytes per line; the hex and ASCII columns for the whole
+            # buffer are each produced by one C-level call and then sliced per line
+            hex_text = mem.hex(' ')
+            text = mem.translate(_ASCII_TABLE).decode('ascii')
+            lines = [{
+                'address': f"0x{address + offset:016x}",
+                'bytes': hex_text[offset * 3:offset * 3 + 47],
+                'ascii': text[offset:offset + 16]
+            } for offset in range(0, len(mem), 16)]
             
-            # Parse the disassembly output
-            lines = []
-            output_lines = output.strip().split('\n')
+            # Send as proper message format expected by Swift
+            return {"type": "memory", "payload": {"lines": lines}}
+        except Exception as e:
+            log_error(f"Exception in readMemory: {str(e)}", e)
+            return self.buildError(f"readMemory failed: {str(e)}")
+
+    def writeByte(self, address, value):
+        """Patch one byte; the UI sends the value as a "0x.." string"""
+        try:
+            if isinstance(value, str):
+                value = int(value, 16) if value.startswith("0x") else int(value)
+            # bytes() rejects values outside 0..255 rather than truncating them
+            data = bytes((value,))
+        except (TypeError, ValueError):
+            return self.buildError("value must be a byte")
+        return self._writeMemory(address, data)
+
+    def writeBytes(self, address, data):
+        """Patch a run of bytes given as a hex string with one WriteMemory call"""
+        try:
+            data = bytes.fromhex(data)
+        except (TypeError, ValueError):
+            return self.buildError("bytes must be a hex string")
+        if not data:
+            return self.buildError("no bytes to write")
+        return self._writeMemory(address, data)
+
+    def _writeMemory(self, address, data):
+        try:
+            process = self.process
+            if process is None:
+                return self.buildError("no process")
+            if not process.IsValid():
+                return self.buildError("process not valid")
             
-            for line in output_lines:
-                line = line.strip()
-                if not line or line.startswith('(') or line.startswith('Process') or line.endswith(':'):
-                    continue
-                
-                # Handle LLDB format: "->  0x7ff8125dd93a <+10>: retq" or "    0x7ff8125dd93b <+11>: nop"
-                # Remove arrow indicator and extra spaces
-                line = line.replace('->', '').strip()
-                
-                # Parse line format: "0x7ff8125dd93a <+10>: retq" or "0x12345678: 48 89 e5    movq   %rsp, %rbp"
-                parts = line.split(':', 1)
-                if len(parts) != 2:
-                    continue
-                
-                addr_part = parts[0].strip()
-                
-                # Extract address from formats like "0x7ff8125dd93a <+10>" or "0x7ff8125dd93a"
-                if '<' in addr_part:
-                    addr_part = addr_part.split('<')[0].strip()
-                
-                if not addr_part.startswith('0x'):
-                    continue
-                
-                try:
-                    addr = int(addr_part, 16)
-                except ValueError:
-                    continue
-                
-                # Parse instruction part
-                inst_part = parts[1].strip()
-                
-                # Split instruction part - could be "retq" or "48 89 e5    movq   %rsp, %rbp"
-                inst_parts = inst_part.split()
-                
-                if len(inst_parts) >= 1:
-                    # Check if first part looks like hex bytes (contains only hex digits)
-                    first_part = inst_parts[0]
-                    if len(first_part) == 2 and all(c in '0123456789abcdefABCDEF' for c in first_part):
-                        # Format with bytes: "48 89 e5    movq   %rsp, %rbp"
-                        hex_bytes = ' '.join(inst_parts[0:3])  # Take first few parts as bytes
-                        if len(inst_parts) > 3:
-                            instruction = inst_parts[3]
-                            operands = ' '.join(inst_parts[4:]) if len(inst_parts) > 4 else ""
-                        else:
-                            instruction = "???"
-                            operands = ""
-                    else:
-                        # Format without bytes: "retq" or "movq %rsp, %rbp"
-                        hex_bytes = ""
-                        instruction = inst_parts[0]
-                        operands = ' '.join(inst_parts[1:]) if len(inst_parts) > 1 else ""
-                    
-                    lines.append({
-                        'address': addr,
-                        'instruction': instruction,
-                        'operands': operands,
-                        'bytes': hex_bytes
-                    })
+            # Handle address parameter - could be string or int
+            if isinstance(address, str):
+                if address.startswith("0x"):
+                    address = int(address, 16)
+                else:
+                    address = int(address)
             
-            if not lines:
-                return self.buildError("no valid disassembly lines found")
+            if _VERBOSE:
+                log_lldb(f"Writing {len(data)} bytes at 0x{address:x}")
             
-            log_lldb(f"Successfully disassembled {len(lines)} instructions")
-            # Send as proper message format expected by Swift
-            return {"type": "disassembly", "payload": {"lines": lines}}
+            err = lldb.SBError()
+            process.WriteMemory(address, data, err)
+            if not err.Success():
+                return self.buildError(f"unable to write memory at 0x{address:x}: {err.GetCString()}")
+            
+            # Patched code does not bump the stop ID, so cached disassembly may now be stale
+            self._disasm_cache.clear()
+            return self.buildOK()
         except Exception as e:
-            log_error(f"Exception in disassembly: {str(e)}", e)
-            return self.buildError(f"disassembly failed: {str(e)}")
+            log_error(f"Exception in writeMemory: {str(e)}", e)
+            return self.buildError(f"writeMemory failed: {str(e)}")
+
+    def _isSystemModule(self, module):
+        """Whether module is a macOS system library rather than user code"""
+        # The same few libSystem modules recur on every step; classify each image once
+        uuid = module.GetUUIDString()
+        if uuid:
+            is_system = self._system_modules.get(uuid)
+            if is_system != None:
+                return is_system
+        file_spec = module.GetFileSpec()
+        directory = file_spec.GetDirectory()
+        module_name = file_spec.GetFilename()
+        is_system = bool(directory and (directory + "/").startswith(_SYSTEM_LIBRARY_PREFIXES)) or \
+            (bool(module_name) and (module_name.startswith(_SYSTEM_LIBRARY_NAMES) or module_name.endswith(".dylib")))
+        if uuid:
+            self._system_modules[uuid] = is_system
+        return is_system
+
+    def _waitForStop(self, process, timeout_s, states=_RUNNING_STATES):
+        """Block on state-change events until the process leaves `states`; returns the final state
+
+        A timeout_s of None waits without limit, in 1 s slices that re-check GetState(), so a
+        state change broadcast before the listener subscribed cannot strand the wait.
+        SBListener only takes whole seconds, so each wait is rounded up to at least 1 s and
+        a timeout can overshoot by up to 1 s. The wait returns as soon as the state
+        changes, so this only affects timeouts.
+        """
+        listener = self._stateListener
+        broadcaster = process.GetBroadcaster()
+        event = lldb.SBEvent()
+        # Bound once so the loop body only touches locals
+        get_state = process.GetState
+        wait = listener.WaitForEventForBroadcasterWithType
+        mask = lldb.SBProcess.eBroadcastBitStateChanged
+        now = time.monotonic
+        # Drop state changes left over from earlier operations; GetState() below is authoritative
+        listener.Clear()
+        state = get_state()
+        if timeout_s is None:
+            while state in states:
+                wait(1, broadcaster, mask, event)
+                state = get_state()
+            return state
+        deadline = now() + timeout_s
+        while state in states:
+            remaining = deadline - now()
+            if remaining <= 0:
+                break
+            wait(max(1, math.ceil(remaining)), broadcaster, mask, event)
+            state = get_state()
+        return state
 
     def stepInstruction(self):
         """Step one instruction (step over calls)"""
@@ -326,10 +624,9 @@ class Handler:
     
     def _stepInstruction(self, step_into_calls=False):
         try:
-            if self.target == None or self.target.GetProcess() == None:
+            process = self.process
+            if process is None:
                 return self.buildError("no process")
-            
-            process = self.target.GetProcess()
             if not process.IsValid():
                 return self.buildError("process not valid")
             
@@ -339,37 +636,35 @@ class Handler:
                 log_lldb("Process is running, stopping first...")
                 process.Stop()
                 # Wait for it to stop
-                timeout = 50
-                while process.GetState() == lldb.eStateRunning and timeout > 0:
-                    time.sleep(0.01)
-                    timeout -= 1
+                state = self._waitForStop(process, 0.5)
             
             # Check if we're in a valid state for stepping
-            if process.GetState() not in [lldb.eStateStopped, lldb.eStateSuspended]:
-                log_error(f"Process not in stoppable state: {process.GetState()}")
-                return self.buildError(f"process state invalid for stepping: {process.GetState()}")
+            if state not in [lldb.eStateStopped, lldb.eStateSuspended]:
+                log_error(f"Process not in stoppable state: {state}")
+                return self.buildError(f"process state invalid for stepping: {state}")
             
             thread = process.GetThreadAtIndex(0)
             if not thread.IsValid():
                 return self.buildError("no valid thread")
             
             step_type = "into" if step_into_calls else "over"
-            log_lldb(f"Stepping one instruction ({step_type})")
+            if _VERBOSE:
+                log_lldb(f"Stepping one instruction ({step_type})")
             
             # Get current PC before stepping
             frame = thread.GetFrameAtIndex(0)
             old_pc = frame.GetPC() if frame.IsValid() else 0
-            log_lldb(f"Current PC before step: 0x{old_pc:x}")
+            if _VERBOSE:
+                log_lldb(f"Current PC before step: 0x{old_pc:x}")
             
             # Check if we're in system library code
             in_system_lib = False
             if frame.IsValid():
                 module = frame.GetModule()
-                if module.IsValid():
-                    module_name = module.GetFileSpec().GetFilename()
-                    if module_name and ("libsystem" in module_name or "dylib" in module_name):
-                        in_system_lib = True
-                        log_lldb(f"Stepping in system library: {module_name}")
+                if module.IsValid() and self._isSystemModule(module):
+                    in_system_lib = True
+                    if _VERBOSE:
+                        log_lldb(f"Stepping in system library: {module.GetFileSpec().GetFilename()}")
             
             # Step one instruction
             try:
@@ -388,16 +683,11 @@ class Handler:
                     return self.buildError(f"stepping failed: {str(step_e)}")
             
             # Wait for the process to stop
-            timeout = 100  # 1 second timeout
-            while process.GetState() == lldb.eStateRunning and timeout > 0:
-                time.sleep(0.01)
-                timeout -= 1
-            
-            # Check final state
-            final_state = process.GetState()
-            log_lldb(f"Process state after step: {final_state}")
+            final_state = self._waitForStop(process, 1.0)
+            if _VERBOSE:
+                log_lldb(f"Process state after step: {final_state}")
             
-            if timeout <= 0:
+            if final_state in _RUNNING_STATES:
                 log_error(f"Step instruction ({step_type}) timeout, final state: {final_state}")
                 # Don't return error immediately, try to get PC anyway
                 log_lldb("Attempting to get PC despite timeout...")
@@ -405,75 +695,16 @@ class Handler:
                 log_lldb(f"Process not stopped after step, state: {final_state}")
                 # Continue anyway, might still be able to get PC
             
-            # Get new PC after step - try multiple methods
+            # Get new PC after step
             frame = thread.GetFrameAtIndex(0)
-            pc = 0
-            
             if frame.IsValid():
                 pc = frame.GetPC()
-                log_lldb(f"Step ({step_type}) completed, new PC: 0x{pc:x}")
+                if _VERBOSE:
+                    log_lldb(f"Step ({step_type}) completed, new PC: 0x{pc:x}")
             else:
-                # Frame might be invalid, try getting PC directly from thread
-                log_lldb("Frame invalid after step, trying to get PC from thread...")
-                try:
-                    # Try to get PC from registers using a different approach
-                    if thread.GetNumFrames() > 0:
-                        try:
-                            frame_0 = thread.GetFrameAtIndex(0)
-                            if frame_0:
-                                registers = frame_0.GetRegisters()
-                                if registers:
-                                    for reg_set in registers:
-                                        for reg in reg_set:
-                                            reg_name = reg.GetName().lower()
-                                            if reg_name in ['pc', 'rip', 'eip']:
-                                                reg_value = reg.GetValue()
-                                                if reg_value:
-                                                    pc = int(reg_value, 16)
-                                                    log_lldb(f"Got PC from register {reg_name}: 0x{pc:x}")
-                                                    break
-                                        if pc != 0:
-                                            break
-                        except Exception as reg_e:
-                            log_lldb(f"Error accessing registers: {str(reg_e)}")
-                    
-                    # Alternative method: use LLDB command to get PC
-                    if pc == 0:
-                        try:
-                            result = lldb.SBCommandReturnObject()
-                            self.target.GetDebugger().GetCommandInterpreter().HandleCommand("register read pc", result)
-                            if result.Succeeded():
-                                output = result.GetOutput()
-                                # Parse PC from output like "pc = 0x7ff8125dd93b"
-                                import re
-                                match = re.search(r'pc\s*=\s*0x([0-9a-fA-F]+)', output)
-                                if match:
-                                    pc = int(match.group(1), 16)
-                                    log_lldb(f"Got PC from command: 0x{pc:x}")
-                        except Exception as cmd_e:
-                            log_lldb(f"Error using register command: {str(cmd_e)}")
-                    
-                    # If still no PC, try alternative method
-                    if pc == 0:
-                        # Get thread info
-                        thread_info = thread.GetStopDescription(256)
-                        log_lldb(f"Thread stop description: {thread_info}")
-                        
-                        # Try to refresh thread state
-                        process.GetThreadAtIndex(0).GetFrameAtIndex(0)
-                        new_frame = thread.GetFrameAtIndex(0)
-                        if new_frame.IsValid():
-                            pc = new_frame.GetPC()
-                            log_lldb(f"Got PC after refresh: 0x{pc:x}")
-                        else:
-                            # Last resort - use old PC and log warning
-                            pc = old_pc
-                            log_lldb(f"Warning: Could not get new PC, using old PC: 0x{pc:x}")
-                            
-                except Exception as e:
-                    log_error(f"Error getting PC after step: {str(e)}", e)
-                    pc = old_pc
-                    log_lldb(f"Using old PC due to error: 0x{pc:x}")
+                # Without a valid frame 0 there is no register context to read the pc from either
+                pc = old_pc
+                log_lldb(f"Warning: Frame invalid after step, using old PC: 0x{pc:x}")
             
             # Check if PC actually changed
             if pc == old_pc:
@@ -487,10 +718,7 @@ class Handler:
                         thread.StepOut()
                         
                         # Wait a bit for step out to complete
-                        step_out_timeout = 50
-                        while process.GetState() == lldb.eStateRunning and step_out_timeout > 0:
-                            time.sleep(0.01)
-                            step_out_timeout -= 1
+                        self._waitForStop(process, 0.5)
                         
                         # Try to get new PC after step out
                         new_frame = thread.GetFrameAtIndex(0)
@@ -500,45 +728,24 @@ class Handler:
                                 pc = new_pc
                                 log_lldb(f"Step out successful, new PC: 0x{pc:x}")
                             else:
-                                log_lldb("Step out didn't change PC, trying continue...")
-                                # If step out didn't work, try continue briefly
-                                process.Continue()
-                                time.sleep(0.01)  # Very brief continue
-                                process.Stop()
-                                
-                                # Wait for stop
-                                stop_timeout = 30
-                                while process.GetState() == lldb.eStateRunning and stop_timeout > 0:
-                                    time.sleep(0.01)
-                                    stop_timeout -= 1
-                                
-                                # Get PC after continue/stop
-                                final_frame = thread.GetFrameAtIndex(0)
-                                if final_frame.IsValid():
-                                    pc = final_frame.GetPC()
-                                    log_lldb(f"Continue/stop resulted in PC: 0x{pc:x}")
+                                # Report where we are; the client can issue another step
+                                log_lldb("Step out didn't change PC")
                         else:
                             log_lldb("Step out completed but frame still invalid")
                             
                     except Exception as step_out_e:
-                        log_lldb(f"Step out failed: {str(step_out_e)}")
+                        log_lldb(f"Step out failed: {step_out_e}")
                 else:
                     # Not in system library but PC didn't change - might be a different issue
                     log_lldb("PC didn't change in user code - this might indicate a problem")
             
             # Always send event, even if PC didn't change or we had issues
-            log_lldb(f"Step ({step_type}) completed, PC: 0x{pc:x} (was: 0x{old_pc:x})")
+            if _VERBOSE:
+                log_lldb(f"Step ({step_type}) completed, PC: 0x{pc:x} (was: 0x{old_pc:x})")
             
             # Send stopped event with specific reason
             reason = "step_into" if step_into_calls else "step_over"
-            self.sendEvent({
-                "type": "stopped", 
-                "payload": {
-                    "reason": reason,
-                    "pc": pc,
-                    "thread_id": thread.GetThreadID()
-                }
-            })
+            self.sendStopEvent(reason, pc, thread.GetThreadID())
             
             return self.buildOK()
         except Exception as e:
@@ -547,45 +754,28 @@ class Handler:
     
     def stepOver(self):
         try:
-            if self.target == None or self.target.GetProcess() == None:
-                return self.buildError("no process")
+            process, thread, error = self._threadContext()
+            if error != None:
+                return error
             
-            process = self.target.GetProcess()
-            if not process.IsValid():
-                return self.buildError("process not valid")
-            
-            thread = process.GetThreadAtIndex(0)
-            if not thread.IsValid():
-                return self.buildError("no valid thread")
-            
-            log_lldb("Stepping over")
+            if _VERBOSE:
+                log_lldb("Stepping over")
             
             # Step over (next line)
             thread.StepOver()
             
             # Wait for the process to stop
-            timeout = 100
-            while process.GetState() == lldb.eStateRunning and timeout > 0:
-                time.sleep(0.01)
-                timeout -= 1
-            
-            if timeout <= 0:
+            if self._waitForStop(process, 1.0) in _RUNNING_STATES:
                 return self.buildError("step over timeout")
             
             # Get new PC after step
             frame = thread.GetFrameAtIndex(0)
             if frame.IsValid():
                 pc = frame.GetPC()
-                log_lldb(f"Step over completed, new PC: 0x{pc:x}")
+                if _VERBOSE:
+                    log_lldb(f"Step over completed, new PC: 0x{pc:x}")
                 
-                self.sendEvent({
-                    "type": "stopped", 
-                    "payload": {
-                        "reason": "step_over",
-                        "pc": pc,
-                        "thread_id": thread.GetThreadID()
-                    }
-                })
+                self.sendStopEvent("step_over", pc, thread.GetThreadID())
             
             return self.buildOK()
         except Exception as e:
@@ -594,45 +784,28 @@ class Handler:
     
     def stepOut(self):
         try:
-            if self.target == None or self.target.GetProcess() == None:
-                return self.buildError("no process")
+            process, thread, error = self._threadContext()
+            if error != None:
+                return error
             
-            process = self.target.GetProcess()
-            if not process.IsValid():
-                return self.buildError("process not valid")
-            
-            thread = process.GetThreadAtIndex(0)
-            if not thread.IsValid():
-                return self.buildError("no valid thread")
-            
-            log_lldb("Stepping out")
+            if _VERBOSE:
+                log_lldb("Stepping out")
             
             # Step out of current function
             thread.StepOut()
             
-            # Wait for the process to stop
-            timeout = 200  # Longer timeout for step out
-            while process.GetState() == lldb.eStateRunning and timeout > 0:
-                time.sleep(0.01)
-                timeout -= 1
-            
-            if timeout <= 0:
+            # Wait for the process to stop (longer timeout for step out)
+            if self._waitForStop(process, 2.0) in _RUNNING_STATES:
                 return self.buildError("step out timeout")
             
             # Get new PC after step
             frame = thread.GetFrameAtIndex(0)
             if frame.IsValid():
                 pc = frame.GetPC()
-                log_lldb(f"Step out completed, new PC: 0x{pc:x}")
+                if _VERBOSE:
+                    log_lldb(f"Step out completed, new PC: 0x{pc:x}")
                 
-                self.sendEvent({
-                    "type": "stopped", 
-                    "payload": {
-                        "reason": "step_out",
-                        "pc": pc,
-                        "thread_id": thread.GetThreadID()
-                    }
-                })
+                self.sendStopEvent("step_out", pc, thread.GetThreadID())
             
             return self.buildOK()
         except Exception as e:
@@ -642,79 +815,55 @@ class Handler:
     def stepUntilUserCode(self):
         """Step until we're out of system library code"""
         try:
-            if self.target == None or self.target.GetProcess() == None:
-                return self.buildError("no process")
-            
-            process = self.target.GetProcess()
-            if not process.IsValid():
-                return self.buildError("process not valid")
-            
-            thread = process.GetThreadAtIndex(0)
-            if not thread.IsValid():
-                return self.buildError("no valid thread")
-            
-            log_lldb("Stepping until user code...")
+            process, thread, error = self._threadContext()
+            if error != None:
+                return error
             
-            max_attempts = 20  # Prevent infinite loops
-            attempts = 0
+            if _VERBOSE:
+                log_lldb("Stepping until user code...")
             
-            while attempts < max_attempts:
-                frame = thread.GetFrameAtIndex(0)
+            # Find the innermost system frame whose caller is user code
+            system_frame = None
+            for i in range(thread.GetNumFrames()):
+                frame = thread.GetFrameAtIndex(i)
                 if not frame.IsValid():
                     break
-                
-                # Check if we're in system library
                 module = frame.GetModule()
-                in_system_lib = False
-                if module.IsValid():
-                    module_name = module.GetFileSpec().GetFilename()
-                    if module_name and ("libsystem" in module_name or "dylib" in module_name):
-                        in_system_lib = True
-                
-                if not in_system_lib:
-                    log_lldb("Reached user code!")
+                if not (module.IsValid() and self._isSystemModule(module)):
                     break
+                system_frame = frame
+            else:
+                # No user code anywhere on the stack; just leave the current frame
+                if system_frame != None:
+                    system_frame = thread.GetFrameAtIndex(0)
+            
+            if system_frame == None:
+                if _VERBOSE:
+                    log_lldb("Reached user code!")
+            else:
+                if _VERBOSE:
+                    log_lldb(f"In system code, stepping out of frame #{system_frame.GetFrameID()}...")
                 
-                log_lldb(f"Still in system code (attempt {attempts + 1}), stepping out...")
-                
-                # Try step out
-                thread.StepOut()
+                # One step out of the whole run of system frames instead of one StepOut per frame
+                step_err = lldb.SBError()
+                thread.StepOutOfFrame(system_frame, step_err)
+                if step_err.Fail():
+                    return self.buildError(f"step out of frame failed: {step_err.GetCString()}")
                 
                 # Wait for completion
-                timeout = 100
-                while process.GetState() == lldb.eStateRunning and timeout > 0:
-                    time.sleep(0.01)
-                    timeout -= 1
-                
-                if timeout <= 0:
-                    log_lldb("Timeout during step out, trying continue...")
-                    # Try continue briefly as fallback
-                    process.Continue()
-                    time.sleep(0.05)
+                if self._waitForStop(process, 5.0) in _RUNNING_STATES:
+                    log_lldb("Timeout during step out, stopping...")
                     process.Stop()
-                    
-                    # Wait for stop
-                    stop_timeout = 50
-                    while process.GetState() == lldb.eStateRunning and stop_timeout > 0:
-                        time.sleep(0.01)
-                        stop_timeout -= 1
-                
-                attempts += 1
+                    self._waitForStop(process, 0.5)
             
             # Get final PC
             frame = thread.GetFrameAtIndex(0)
             if frame.IsValid():
                 pc = frame.GetPC()
-                log_lldb(f"Step until user code completed, PC: 0x{pc:x}")
+                if _VERBOSE:
+                    log_lldb(f"Step until user code completed, PC: 0x{pc:x}")
                 
-                self.sendEvent({
-                    "type": "stopped", 
-                    "payload": {
-                        "reason": "step_until_user_code",
-                        "pc": pc,
-                        "thread_id": thread.GetThreadID()
-                    }
-                })
+                self.sendStopEvent("step_until_user_code", pc, thread.GetThreadID())
             else:
                 log_error("Invalid frame after step until user code")
                 return self.buildError("invalid frame after step until user code")
@@ -726,14 +875,14 @@ class Handler:
     
     def continueExecution(self):
         try:
-            if self.target == None or self.target.GetProcess() == None:
+            process = self.process
+            if process is None:
                 return self.buildError("no process")
-            
-            process = self.target.GetProcess()
             if not process.IsValid():
                 return self.buildError("process not valid")
             
-            log_lldb("Continuing execution")
+            if _VERBOSE:
+                log_lldb("Continuing execution")
             
             # Continue execution
             process.Continue()
@@ -745,41 +894,30 @@ class Handler:
     
     def stopExecution(self):
         try:
-            if self.target == None or self.target.GetProcess() == None:
+            process = self.process
+            if process is None:
                 return self.buildError("no process")
-            
-            process = self.target.GetProcess()
             if not process.IsValid():
                 return self.buildError("process not valid")
             
-            log_lldb("Stopping execution")
+            if _VERBOSE:
+                log_lldb("Stopping execution")
             
             # Stop/halt the process
             process.Stop()
             
             # Wait for it to actually stop
-            timeout = 100
-            while process.GetState() == lldb.eStateRunning and timeout > 0:
-                time.sleep(0.01)
-                timeout -= 1
-            
-            if process.GetState() == lldb.eStateStopped:
+            if self._waitForStop(process, 1.0) == lldb.eStateStopped:
                 # Get current PC
                 thread = process.GetThreadAtIndex(0)
                 if thread.IsValid():
                     frame = thread.GetFrameAtIndex(0)
                     if frame.IsValid():
                         pc = frame.GetPC()
-                        log_lldb(f"Process stopped at PC: 0x{pc:x}")
+                        if _VERBOSE:
+                            log_lldb(f"Process stopped at PC: 0x{pc:x}")
                         
-                        self.sendEvent({
-                            "type": "stopped", 
-                            "payload": {
-                                "reason": "interrupted",
-                                "pc": pc,
-                                "thread_id": thread.GetThreadID()
-                            }
-                        })
+                        self.sendStopEvent("interrupted", pc, thread.GetThreadID())
             
             return self.buildOK()
         except Exception as e:
@@ -788,10 +926,9 @@ class Handler:
     
     def detach(self):
         try:
-            if self.target == None or self.target.GetProcess() == None:
+            process = self.process
+            if process is None:
                 return self.buildError("no process")
-            
-            process = self.target.GetProcess()
             if not process.IsValid():
                 return self.buildError("process not valid")
             
@@ -800,14 +937,13 @@ class Handler:
             # Detach from the process
             process.Detach()
             
-            # Clean up
+            # Clean up; the target itself stays resident in self._targets for the next attach,
+            # so drop this session's breakpoints rather than letting them re-resolve there
+            self.target.DeleteAllBreakpoints()
             self.target = None
             self.process = None
             
-            # Stop event thread
-            if self.eventThread:
-                self.eventThread.running = False
-                self.eventThread = None
+            # Keep the event thread: it idles blocked on the listener and is reused by the next attach
             
             log_lldb("Successfully detached from process")
             return self.buildOK()
@@ -895,83 +1031,18 @@ class Handler:
     def handleRequest(self, req):
         try:
             command = req.get("command")
-            log_python_server(f"Handling request: {command}")
-            
-            if command == "attachToProcess":
-                pid = req.get("pid")
-                executable = req.get("executable")
-                is64Bits = req.get("is64Bits", True)
-                result = self.attachToProcess(pid, executable, is64Bits)
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "getRegisters":
-                result = self.getRegisters()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "disassembly":
-                address = req.get("address", 0)
-                count = req.get("count", 10)
-                result = self.disassembly(address, count)
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "stepInstruction":
-                result = self.stepInstruction()
-                log_python_server(f"Sending response: {result}")
-                return result
+            if _VERBOSE:
+                log_python_server(f"Handling request: {command}")
             
-            elif command == "stepInto":
-                result = self.stepInto()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "stepOver":
-                result = self.stepOver()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "stepOut":
-                result = self.stepOut()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "stepUntilUserCode":
-                result = self.stepUntilUserCode()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "continueExecution":
-                result = self.continueExecution()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "stopExecution":
-                result = self.stopExecution()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "detach":
-                result = self.detach()
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "setBreakpoint":
-                address = req.get("address")
-                bp_type = req.get("type", "software")
-                result = self.setBreakpoint(address, bp_type)
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            elif command == "removeBreakpoint":
-                bp_id = req.get("id")
-                result = self.removeBreakpoint(bp_id)
-                log_python_server(f"Sending response: {result}")
-                return result
-            
-            else:
+            entry = self._dispatch.get(command)
+            if entry == None:
                 return self.buildError(f"Unknown command: {command}")
+            
+            fn, spec = entry
+            result = fn(*[req.get(key, default) for key, default in spec])
+            if _VERBOSE:
+                log_python_server(f"Sending response: {result.get('type') or result.get('status')}")
+            return result
                 
         except Exception as e:
             log_error(f"Exception in handleRequest: {str(e)}", e)
@@ -980,14 +1051,40 @@ class Handler:
     def run(self):
         log_python_server("Python server started")
         
-        while True:
+        done = False
+        req = None
+        while not done:
             try:
-                req = self.transportRead()
                 if req is None:
-                    break
+                    req = self.transportRead()
+                    if req is None:
+                        break
                 
-                response = self.handleRequest(req)
-                self.transportWrite(json.dumps(response))
+                # Events raised by a request (e.g. "stopped") go out with its response in one writev.
+                # Responses to pure queries the client already pipelined into the buffer share that
+                # write, but a step or halt is never batched: the queries before it are flushed
+                # first, and its own event and response go out as soon as it returns.
+                self._deferred = []
+                while True:
+                    batchable = _isBatchable(req)
+                    response = self.handleRequest(req)
+                    req = None
+                    self._deferred.append(_dumps(response))
+                    if not batchable or len(self._deferred) >= _MAX_BATCH_FRAMES or not self._hasBufferedFrame():
+                        break
+                    req = self.transportRead()
+                    if req is None:
+                        done = True
+                        break
+                    if not _isBatchable(req):
+                        # Handled on the next pass, once the responses gathered so far are out
+                        break
+                frames = self._deferred
+                self._deferred = None
+                if len(frames) > 1:
+                    self._writeFrames(frames)
+                else:
+                    self.transportWrite(frames[0])
                 
             except KeyboardInterrupt:
                 log_python_server("Received interrupt, shutting down")
@@ -996,6 +1093,8 @@ class Handler:
                 log_error(f"Error in main loop: {str(e)}", e)
                 break
         
+        if self.eventThread != None:
+            self.eventThread.requestStop()
         log_python_server("Python server stopped")
 
 if __name__ == "__main__":
@@ -1008,7 +1107,7 @@ if __name__ == "__main__":
     input_fd = 0  # stdin
     output_fd = 1  # stdout
     
-    log_python_server(f"Using stdin/stdout for communication")
+    log_python_server("Using stdin/stdout for communication")
     
     # Create and run handler
     handler = Handler(input_fd, output_fd, False)
@@ -12,6 +12,8 @@ import threading
 
 __DO_LOG__=False
 
+_VERBOSE = os.environ.get('MACDBG_VERBOSE', '0') == '1'
+
 def DBG_LOG(msg):
     if __DO_LOG__:
         with open(os.path.expanduser("~/Desktop/Hopper_lldb_output.txt"), "a") as _LOG_FILE:
@@ -19,6 +21,19 @@ def DBG_LOG(msg):
 
 ###############################################################################
 
+# JSON codec for the transport; _dumps returns UTF-8 encoded bytes
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    _encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+    def _dumps(j):
+        return _encode(j).encode("utf-8")
+    _loads = json.loads
+
+###############################################################################
+
 def get_registers(frame, kind):
     registerSet = frame.GetRegisters()
     for value in registerSet:
@@ -29,15 +44,23 @@ def get_registers(frame, kind):
 def build_reg_value_string(reg):
     value = ""
     if reg.MightHaveChildren():
-        c_count = reg.GetNumChildren()
-        offset = 0
-        i_value = 0
-        for child in reg:
-            err = lldb.SBError()
-            i_value += child.GetValueAsUnsigned(err) << offset
-            offset += child.GetByteSize() << 3
-        fmt = "0x%%0%dx" % (reg.GetByteSize() << 1)
-        value = fmt % i_value
+        byte_size = reg.GetByteSize()
+        err = lldb.SBError()
+        data = reg.GetData()
+        raw = None
+        if data is not None and data.IsValid():
+            raw = data.ReadRawData(err, 0, byte_size)
+            if not err.Success():
+                raw = None
+        if raw is not None and len(raw) == byte_size:
+            i_value = int.from_bytes(raw, 'little')
+        else:
+            offset = 0
+            i_value = 0
+            for child in reg:
+                i_value += child.GetValueAsUnsigned(err) << offset
+                offset += child.GetByteSize() << 3
+        value = f"0x{i_value:0{byte_size << 1}x}"
     else:
         value = reg.GetValue()
     return value
@@ -59,12 +82,25 @@ def findRegister(frame,name):
                 return value
     return None
 
-def stateToString(state):
-    state_strings = ["eStateInvalid", "eStateUnloaded", "eStateConnected", "eStateAttaching", "eStateLaunching", "eStateStopped", "eStateRunning", "eStateStepping", "eStateCrashed", "eStateDetached", "eStateExited", "eStateSuspended"]
-    if state >= 0 and state < len(state_strings):
-        return state_strings[state]
-    else:
+def hexlify(data):
+    if isinstance(data, (bytes, bytearray)):
+        return data.hex()
+    # LLDB hands stdio back as a str it decoded from UTF-8; encode it the same way
+    return data.encode('utf-8', 'replace').hex()
+
+_STATE_STRINGS = ("eStateInvalid", "eStateUnloaded", "eStateConnected", "eStateAttaching", "eStateLaunching", "eStateStopped", "eStateRunning", "eStateStepping", "eStateCrashed", "eStateDetached", "eStateExited", "eStateSuspended")
+
+_STOP_REASONS = ('Invalid', 'None', 'Trace', 'Breakpoint', 'Watchpoint', 'Signal', 'Exception', 'Exec', 'Plan Complete', 'Thread Exiting')
+
+_STATE_STRINGS_DICT = dict(enumerate(_STATE_STRINGS))
+
+_STOP_REASONS_DICT = dict(enumerate(_STOP_REASONS))
+
+def stateToString(state, _get=_STATE_STRINGS_DICT.get):
+    desc = _get(state)
+    if desc == None:
         return "invalid state (%d)" % state
+    return desc
 
 ###############################################################################
 
@@ -80,13 +116,60 @@ class Handler(threading.Thread):
         self.executable = None
         self.is64Bits = True
         self.debugger = lldb.SBDebugger.Create()
+        self._ci = self.debugger.GetCommandInterpreter()
+        self._cmd_result = lldb.SBCommandReturnObject()
         self.debugger.SetAsync(True)
         self.transport_lock = threading.Lock()
+        self._reg_schema = {}
+        self._env_entries = None
+        self._module_names = {}
+        # Frame descriptions are only reused within one stop, so the cache never outgrows a callstack
+        self._frame_desc_cache = {}
+        self._frame_desc_stop_id = None
+        self.state_listener = lldb.SBListener("Hopper state listener")
+        self._dispatch = {
+            'ping': lambda req: self.buildOK(),
+            'prepareExecutable': lambda req: self.prepareExecutable(req['path'], req['is64Bits'], req['cwd'], req['args']),
+            'createProcess': lambda req: self.createProcess(),
+            'attachToProcess': lambda req: self.attachToProcess(req['pid'], req['executable'], req['is64Bits']),
+            'detach': lambda req: self.detach(),
+            'deleteProcess': lambda req: self.deleteProcess(),
+            'hasProcess': lambda req: self.hasProcess(),
+            'getProcessState': lambda req: self.getProcessState(),
+            'continueExecution': lambda req: self.continueExecution(),
+            'stopExecution': lambda req: self.stopExecution(),
+            'breakExecution': lambda req: self.breakExecution(),
+            'getThreadIDList': lambda req: self.getThreadIDList(),
+            'selectThreadID': lambda req: self.selectThreadID(req['tid']),
+            'getRegisters': lambda req: self.getRegisters(),
+            'setBreakpointAtVirtualAddress': lambda req: self.setBreakpointAtVirtualAddress(req['address']),
+            'removeBreakpoint': lambda req: self.removeBreakpoint(req['bkpt_id']),
+            'removeAllBreakpoints': lambda req: self.removeAllBreakpoints(),
+            'stepInstruction': lambda req: self.stepInstruction(),
+            'stepOver': lambda req: self.stepOver(),
+            'stepOut': lambda req: self.stepOut(),
+            'readMemory': lambda req: self.readMemory(req['address'], req['length']),
+            'writeByte': lambda req: self.writeByte(req['address'], req['value']),
+            'writeBytes': lambda req: self.writeBytes(req['address'], req['bytes']),
+            'getCallstack': lambda req: self.getCallstack(),
+            'selectFrame': lambda req: self.selectFrame(req['index']),
+            'setRegister': lambda req: self.setRegister(req['register'], req['value']),
+            'executeCommand': lambda req: self.executeCommand(req['cli']),
+            'completeCommand': lambda req: self.completeCommand(req['cli'], req['pos']),
+            'sendToApplication': lambda req: self.sendToApplication(req['data']),
+            'moduleCount': lambda req: self.moduleCount(),
+            'moduleAtIndex': lambda req: self.moduleAtIndex(req['index']),
+            'moduleForFile': lambda req: self.moduleForFile(req['file']),
+            'connectRemote': lambda req: self.connectRemote(req['is64Bits'], req['url'], req['plugin'], req['platform'], req['file']),
+        }
         
         class EventThread(threading.Thread):
             def __init__(self,handler):
                 threading.Thread.__init__(self)
                 self.handler = handler
+                self.stopRequest = False
+                self.shutdownBroadcaster = lldb.SBBroadcaster("Hopper shutdown")
+                self.pendingModules = []
 
             def getModulesFromEvents(self,lldb,event,target):
                 lldb_modules = []
@@ -114,9 +197,49 @@ class Handler(threading.Thread):
                         })
                 return hopper_modules
 
+            def requestStop(self):
+                self.stopRequest = True
+                self.shutdownBroadcaster.BroadcastEventByType(1)
+
+            def onStateChanged(self,event):
+                state = lldb.SBProcess.GetStateFromEvent(event)
+                resp = {"status":"event", "type":"state", "inferior_state":state, "state_desc": stateToString(state)}
+                if state == 10:
+                    resp["exit_status"] = self.process.GetExitStatus()
+                self.handler.sendJSON(resp)
+
+            def onSTDOUT(self,event):
+                data=self.process.GetSTDOUT(256)
+                if data is not None and len(data) > 0:
+                    self.handler.sendJSON({"status":"event", "type":"stdout", "output": hexlify(data)})
+
+            def onSTDERR(self,event):
+                data=self.process.GetSTDERR(256)
+                if data is not None and len(data) > 0:
+                    self.handler.sendJSON({"status":"event", "type":"stderr", "output": hexlify(data)})
+
+            def onModulesLoaded(self,event):
+                # Held back and sent by flushModules() once the burst of load events drains
+                self.pendingModules.extend(self.getModulesFromEvents(lldb,event,self.target))
+
+            def flushModules(self):
+                if self.pendingModules:
+                    modules = self.pendingModules
+                    self.pendingModules = []
+                    self.handler.sendJSON({"status":"event", "type":"moduleLoaded", "modules":modules})
+
+            def onModulesUnloaded(self,event):
+                modules = []
+                self.handler.sendJSON({"status":"event", "type":"moduleUnloaded", "modules":modules})
+
+            def onIgnoredEvent(self,event):
+                pass
+
             def run(self):
                 target = self.handler.target
                 process = target.GetProcess()
+                self.target = target
+                self.process = process
 
                 listener = lldb.SBListener("Hopper listener")
 
@@ -126,44 +249,45 @@ class Handler(threading.Thread):
                 targetBroadcaster = target.GetBroadcaster()
                 targetBroadcaster.AddListener(listener, lldb.SBTarget.eBroadcastBitModulesLoaded | lldb.SBTarget.eBroadcastBitModulesUnloaded)
 
-                self.stopRequest = False
+                self.shutdownBroadcaster.AddListener(listener, 1)
+
+                processDispatch = {
+                    lldb.SBProcess.eBroadcastBitStateChanged: self.onStateChanged,
+                    lldb.SBProcess.eBroadcastBitSTDOUT: self.onSTDOUT,
+                    lldb.SBProcess.eBroadcastBitSTDERR: self.onSTDERR,
+                }
+                targetDispatch = {
+                    lldb.SBTarget.eBroadcastBitModulesLoaded: self.onModulesLoaded,
+                    lldb.SBTarget.eBroadcastBitModulesUnloaded: self.onModulesUnloaded,
+                }
+                ignored = self.onIgnoredEvent
+
                 event = lldb.SBEvent()
 
+                # Long wait: requestStop() wakes the listener through the shutdown broadcaster.
+                # While module loads are pending, only drain what is already queued
+                # (WaitForEvent asserts on a zero timeout, so that uses GetNextEvent).
                 while not self.stopRequest:
-                    if listener.WaitForEvent(1, event):
-                        eBroadcaster = event.GetBroadcaster()
+                    if listener.GetNextEvent(event) if self.pendingModules else listener.WaitForEvent(60, event):
                         eType = event.GetType()
                         DBG_LOG("[EVENT] type %d (%s)\n" % (eType, str(event)))
 
-                        if eBroadcaster == processBroadcaster:
-                            if eType == lldb.SBProcess.eBroadcastBitStateChanged:
-                                state = lldb.SBProcess.GetStateFromEvent(event)
-                                resp = {"status":"event", "type":"state", "inferior_state":state, "state_desc": stateToString(state)}
-                                if state == 10:
-                                    resp["exit_status"] = process.GetExitStatus()
-                                self.handler.sendJSON(resp)
-                            elif eType == lldb.SBProcess.eBroadcastBitSTDOUT:
-                                data=process.GetSTDOUT(256)
-                                if data is not None and len(data) > 0:
-                                    self.handler.sendJSON({"status":"event", "type":"stdout", "output": "".join(["%02x" % ord(c) for c in data])})
-                            elif eType == lldb.SBProcess.eBroadcastBitSTDERR:
-                                data=process.GetSTDERR(256)
-                                if data is not None and len(data) > 0:
-                                    self.handler.sendJSON({"status":"event", "type":"stderr", "output": "".join(["%02x" % ord(c) for c in data])})
-
-                        elif eBroadcaster == targetBroadcaster:
-                            if eType == lldb.SBTarget.eBroadcastBitModulesLoaded:
-                                modules = self.getModulesFromEvents(lldb,event,target)
-                                self.handler.sendJSON({"status":"event", "type":"moduleLoaded", "modules":modules})
-                            elif eType == lldb.SBTarget.eBroadcastBitModulesUnloaded:
-                                modules = []
-                                self.handler.sendJSON({"status":"event", "type":"moduleUnloaded", "modules":modules})
+                        if event.BroadcasterMatchesRef(processBroadcaster):
+                            self.flushModules()
+                            processDispatch.get(eType, ignored)(event)
+                        elif event.BroadcasterMatchesRef(targetBroadcaster):
+                            if eType != lldb.SBTarget.eBroadcastBitModulesLoaded:
+                                self.flushModules()
+                            targetDispatch.get(eType, ignored)(event)
+                    else:
+                        self.flushModules()
+                self.flushModules()
                 return
         
         self.eventThread = EventThread(self)
 
     def restartEventThread(self):
-        self.eventThread.stopRequest = True
+        self.eventThread.requestStop()
         self.eventThread.join()
         self.eventThread = EventThread(self)
         self.eventThread.start()
@@ -180,38 +304,36 @@ class Handler(threading.Thread):
                 length_str = self.input_fd.read(4)
                 if len(length_str) < 4:
                     return None
-                length = struct.unpack('i', length_str)[0]
-
-                line = ""
-                while len(line) != length:
-                    rem = length - len(line)
-                    part = self.input_fd.read(rem)
-                    if part == None or len(part) == 0:
+                length = int.from_bytes(length_str, sys.byteorder, signed=True)
+
+                # Fill a single preallocated buffer in place instead of concatenating partial reads
+                buf = bytearray(length)
+                view = memoryview(buf)
+                offset = 0
+                while offset < length:
+                    n = self.input_fd.readinto(view[offset:])
+                    if not n:
                         return None
-                    line += part
-
-                if len(line) < length:
-                    return None
+                    offset += n
 
+                line = buf.decode("utf-8")
                 DBG_LOG("[READ] " + line + "\n")
                 return line
         except BaseException as e:
             raise
             return None
 
-    def transportWrite(self,s):
-        DBG_LOG("[WRITE] " + s + "\n")
-        length = struct.pack('i', len(s))
-        self.transport_lock.acquire()
+    def transportWrite(self,data):
+        if __DO_LOG__:
+            DBG_LOG("[WRITE] " + data.decode("utf-8") + "\n")
         if self.cmd_mode:
-            self.output_fd.write("OUTPUT: ")
+            frame = "OUTPUT: " + data.decode("utf-8") + "\n"
         else:
-            self.output_fd.write(length)
-        self.output_fd.write(s)
-        if self.cmd_mode:
-            self.output_fd.write("\n")
-        self.output_fd.flush()
-        self.transport_lock.release()
+            frame = struct.pack('i', len(data)) + data
+        # Emit the whole frame in one write so the header and payload cannot be split
+        with self.transport_lock:
+            self.output_fd.write(frame)
+            self.output_fd.flush()
 
     def buildError(self,msg):
         return {'status':'error', 'message':msg}
@@ -223,8 +345,7 @@ class Handler(threading.Thread):
             return {'status':'ok', 'message':msg}
 
     def sendJSON(self,j):
-        s = json.dumps(j)
-        self.transportWrite(s)
+        self.transportWrite(_dumps(j))
 
     def sendError(self,msg):
         self.sendJSON(self.buildError(msg))
@@ -236,7 +357,10 @@ class Handler(threading.Thread):
         self.executable = execPath
         self.is64Bits = is64Bits
         self.workingDirectory = cwd
-        self.arguments = shlex.split(args.encode("utf-8"))
+        if isinstance(args, list):
+            self.arguments = args
+        else:
+            self.arguments = shlex.split(args)
         return self.buildOK()
 
     def createProcess(self):
@@ -246,14 +370,15 @@ class Handler(threading.Thread):
             if self.target == None or not self.target.IsValid():
                 return self.buildError("cannot build target")
             launchInfo = lldb.SBLaunchInfo(self.arguments if self.arguments != None else [])
-            launchInfo.SetEnvironmentEntries(["" + k + "=" + os.environ[k] for k in os.environ], False)
+            if self._env_entries == None:
+                self._env_entries = [f"{k}={v}" for k, v in os.environ.items()]
+            launchInfo.SetEnvironmentEntries(self._env_entries, False)
             launchInfo.SetWorkingDirectory(self.workingDirectory.encode("utf-8") if self.workingDirectory != None else "")
             launchInfo.SetLaunchFlags(lldb.eLaunchFlagDisableASLR + lldb.eLaunchFlagStopAtEntry)
             process = self.target.Launch(launchInfo, err)
             if process != None:
                 self.eventThread.start()
-                while process.GetState() == lldb.eStateAttaching:
-                    time.sleep(0.1)
+                self.waitWhileState(process, lldb.eStateAttaching)
                 return self.buildOK()
             else:
                 self.target = None
@@ -273,8 +398,7 @@ class Handler(threading.Thread):
             process = self.target.AttachToProcessWithID(self.debugger.GetListener(),pid,err)
             if process != None:
                 self.eventThread.start()
-                while process.GetState() == lldb.eStateAttaching:
-                    time.sleep(0.1)
+                self.waitWhileState(process, lldb.eStateAttaching)
                 result = self.buildOK()
                 if self.target.GetNumModules() > 0:
                     executableFileSpec = self.target.GetExecutable()
@@ -294,6 +418,25 @@ class Handler(threading.Thread):
                 return self.buildError("cannot attach to process")
         return self.buildError("process already exists")
 
+    def waitWhileState(self,process,state,timeout=None):
+        # Block on state-changed events instead of sleeping between GetState() polls
+        broadcaster = process.GetBroadcaster()
+        mask = lldb.SBProcess.eBroadcastBitStateChanged
+        broadcaster.AddListener(self.state_listener, mask)
+        event = lldb.SBEvent()
+        deadline = None if timeout == None else time.time() + timeout
+        try:
+            while process.GetState() == state:
+                wait = 1
+                if deadline != None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    wait = max(1, int(remaining + 0.999))
+                self.state_listener.WaitForEventForBroadcasterWithType(wait, broadcaster, mask, event)
+        finally:
+            broadcaster.RemoveListener(self.state_listener, mask)
+
     def moduleCount(self):
         if self.target == None or self.target.GetProcess() == None:
             return self.buildError("no process")
@@ -310,17 +453,18 @@ class Handler(threading.Thread):
             desc['filename'] = filename
         sections = []
         gotBase = False
+        target = self.target
+        invalid = lldb.LLDB_INVALID_ADDRESS
+        append = sections.append
         for section in module.section_iter():
-            loadAddr = section.GetLoadAddress(self.target)
-            if loadAddr != lldb.LLDB_INVALID_ADDRESS:
+            loadAddr = section.GetLoadAddress(target)
+            if loadAddr != invalid:
                 gotBase = True
-            section_desc = {}
-            section_desc['name'] = section.GetName()
-            section_desc['fileAddr'] = section.GetFileAddress()
-            section_desc['loadAddr'] = loadAddr
-            section_desc['byteSize'] = section.GetByteSize()
-            section_desc['fileByteSize'] = section.GetFileByteSize()
-            sections.append(section_desc)
+            append({'name': section.GetName(),
+                    'fileAddr': section.GetFileAddress(),
+                    'loadAddr': loadAddr,
+                    'byteSize': section.GetByteSize(),
+                    'fileByteSize': section.GetFileByteSize()})
         desc['sections'] = sections
         return desc
 
@@ -356,14 +500,15 @@ class Handler(threading.Thread):
         self.is64Bits = is64Bits
         self.executable = filename
         if plugin == "kdp-remote":
-            ci = self.debugger.GetCommandInterpreter()
+            ci = self._ci
+            cmd_result = self._cmd_result
 
-            cmd_result = lldb.SBCommandReturnObject()
+            cmd_result.Clear()
             cmd = "target create \"%s\"" % (filename)
             DBG_LOG(cmd + "\n")
             ci.HandleCommand(cmd.encode("utf-8"), cmd_result)
 
-            cmd_result = lldb.SBCommandReturnObject()
+            cmd_result.Clear()
             cmd = "process connect --plugin %s \"%s\"" % (plugin, url)
             DBG_LOG(cmd + "\n")
             ci.HandleCommand(cmd.encode("utf-8"), cmd_result)
@@ -376,9 +521,9 @@ class Handler(threading.Thread):
             self.target = self.debugger.CreateTargetWithFileAndArch(filename.encode("utf-8"), lldb.LLDB_ARCH_DEFAULT_64BIT if self.is64Bits else lldb.LLDB_ARCH_DEFAULT_32BIT)
             process = self.target.ConnectRemote(self.debugger.GetListener(), url.encode("utf-8"), plugin.encode("utf-8"), err)
 
-        for i in xrange(10):
-            DBG_LOG("step %d: %s\n" % (i, stateToString(process.GetState())))
-            time.sleep(0.1)
+        if process != None and process.IsValid():
+            self.waitWhileState(process, process.GetState(), 1)
+            DBG_LOG("connected: %s\n" % stateToString(process.GetState()))
         if process == None or not process.IsValid():
             return self.buildError("cannot connect to remote, invalid process")
         else:
@@ -395,11 +540,13 @@ class Handler(threading.Thread):
         if self.target == None or self.target.GetProcess() == None:
             return self.buildError("no process")
         if self.eventThread != None:
-            self.eventThread.stopRequest = True
+            self.eventThread.requestStop()
             self.eventThread.join()
             self.eventThread = None
         self.target.GetProcess().Destroy()
         self.target = None
+        self._module_names.clear()
+        self._frame_desc_cache.clear()
         return self.buildOK()
 
     def hasProcess(self):
@@ -430,23 +577,14 @@ class Handler(threading.Thread):
                 return self.buildOK()
         return self.buildError("no process")
 
-    def stopReasonToString(self,reason):
-        if reason == 0: return 'Invalid'
-        if reason == 1: return 'None'
-        if reason == 2: return 'Trace'
-        if reason == 3: return 'Breakpoint'
-        if reason == 4: return 'Watchpoint'
-        if reason == 5: return 'Signal'
-        if reason == 6: return 'Exception'
-        if reason == 7: return 'Exec'
-        if reason == 8: return 'Plan Complete'
-        if reason == 9: return 'Thread Exiting'
-        return 'Unknown Reason'
-
     def getThreadIDList(self):
         if self.target == None or self.target.GetProcess() == None:
             return self.buildError("no process")
-        lst = [{"thread-id":thread.GetThreadID(), "state":self.stopReasonToString(thread.GetStopReason())} for thread in self.target.GetProcess()]
+        reason_get = _STOP_REASONS_DICT.get
+        lst = []
+        append = lst.append
+        for thread in self.target.GetProcess():
+            append({"thread-id":thread.GetThreadID(), "state":reason_get(thread.GetStopReason(), 'Unknown Reason')})
         result = self.buildOK()
         result["threads"] = lst
         return result
@@ -494,21 +632,31 @@ class Handler(threading.Thread):
                 DBG_LOG("|    r_gprs=%s\n" % r_gprs)
                 DBG_LOG("|    r_fprs=%s\n" % r_fprs)
                 DBG_LOG("|    r_esrs=%s\n" % r_esrs)
+                lst_set = lst.__setitem__
                 if r_gprs != None:
-                    for reg in r_gprs:
-                        lst[reg.GetName()] = reg.GetValue()
+                    for (name, has_children), reg in zip(self.registerSchema("gpr", r_gprs), r_gprs):
+                        lst_set(name, reg.GetValue())
                 if r_fprs != None:
-                    for reg in r_fprs:
-                        lst[reg.GetName()] = build_reg_value_string(reg)
+                    for (name, has_children), reg in zip(self.registerSchema("fpr", r_fprs), r_fprs):
+                        lst_set(name, build_reg_value_string(reg) if has_children else reg.GetValue())
                 if r_esrs != None:
-                    for reg in r_esrs:
-                        lst[reg.GetName()] = reg.GetValue()
+                    for (name, has_children), reg in zip(self.registerSchema("esr", r_esrs), r_esrs):
+                        lst_set(name, reg.GetValue())
                 result = self.buildOK()
                 DBG_LOG("|   done\n")
                 result["registers"] = lst
                 return result
         return self.buildError("no process")
 
+    def registerSchema(self,kind,regs):
+        # Register names and layout are fixed per architecture, so only query them once
+        key = (self.target.GetTriple(), kind)
+        schema = self._reg_schema.get(key)
+        if schema == None:
+            schema = tuple((reg.GetName(), reg.MightHaveChildren()) for reg in regs)
+            self._reg_schema[key] = schema
+        return schema
+
     def setBreakpointAtVirtualAddress(self,addr):
         target = self.target
         if target == None:
@@ -566,13 +714,28 @@ class Handler(threading.Thread):
         if not err.Success():
             return self.buildError("unable to read memory")
         result = self.buildOK()
-        result["memory"] = struct.unpack('B' * len, mem)
+        result["memory"] = memoryview(mem).tolist()
         return result
 
     def writeByte(self,addr,value):
         if self.target == None or self.target.GetProcess() == None:
             return self.buildError("no process")
-        mem = struct.pack('B', value)
+        if not 0 <= value <= 0xff:
+            return self.buildError("value must be a byte")
+        mem = bytes((value,))
+        err = lldb.SBError()
+        self.target.GetProcess().WriteMemory(addr,mem,err)
+        if not err.Success():
+            return self.buildError("unable to write memory: " + err.GetCString() + ("(%d)" % self.target.GetProcess().GetState()))
+        result = self.buildOK()
+        return result
+
+    def writeBytes(self,addr,data):
+        if self.target == None or self.target.GetProcess() == None:
+            return self.buildError("no process")
+        mem = bytes.fromhex(data)
+        if not mem:
+            return self.buildError("no bytes to write")
         err = lldb.SBError()
         self.target.GetProcess().WriteMemory(addr,mem,err)
         if not err.Success():
@@ -586,15 +749,32 @@ class Handler(threading.Thread):
         module = frame.GetModule()
         if module != None:
             module_uuid = module.GetUUIDString()
-            file = module.GetFileSpec()
-            if file != None:
-                module_name = file.GetFilename()
-        return {"pc": frame.GetPC(), "function": frame.GetFunctionName(), "filename": module_name, "uuid": module_uuid}
+            # Modules without a UUID, and frames without a module, all report None
+            if module_uuid:
+                module_name = self._module_names.get(module_uuid)
+            if module_name == None:
+                file = module.GetFileSpec()
+                if file != None:
+                    module_name = file.GetFilename()
+                    if module_uuid:
+                        self._module_names[module_uuid] = module_name
+        pc = frame.GetPC()
+        key = (module_uuid, pc)
+        desc = self._frame_desc_cache.get(key)
+        if desc == None:
+            desc = {"pc": pc, "function": frame.GetFunctionName(), "filename": module_name, "uuid": module_uuid}
+            self._frame_desc_cache[key] = desc
+        return desc
 
     def getCallstack(self):
         if self.target == None or self.target.GetProcess() == None:
             return self.buildError("no process")
-        thread = self.target.GetProcess().GetSelectedThread()
+        process = self.target.GetProcess()
+        stop_id = process.GetStopID()
+        if stop_id != self._frame_desc_stop_id:
+            self._frame_desc_cache.clear()
+            self._frame_desc_stop_id = stop_id
+        thread = process.GetSelectedThread()
         callstack = [self.getFrameDesc(frame) for frame in thread]
         result = self.buildOK()
         result["callstack"] = callstack
@@ -621,9 +801,9 @@ class Handler(threading.Thread):
         return self.buildOK()
 
     def executeCommand(self,cmd):
-        ci = self.debugger.GetCommandInterpreter()
-        cmd_result = lldb.SBCommandReturnObject()
-        ci.HandleCommand(cmd.encode("utf-8"), cmd_result)
+        cmd_result = self._cmd_result
+        cmd_result.Clear()
+        self._ci.HandleCommand(cmd.encode("utf-8"), cmd_result)
         result = self.buildOK()
         result['output'] = cmd_result.GetOutput()
         result['error'] = cmd_result.GetError()
@@ -631,9 +811,8 @@ class Handler(threading.Thread):
         return result
 
     def completeCommand(self,cmd,cur_pos):
-        ci = self.debugger.GetCommandInterpreter()
         cmd_result = lldb.SBStringList()
-        ci.HandleCompletion(cmd.encode("utf-8"), cur_pos, 0, -1, cmd_result)
+        self._ci.HandleCompletion(cmd.encode("utf-8"), cur_pos, 0, -1, cmd_result)
         result = self.buildOK()
         result['completions'] = [s for s in cmd_result]
         return result
@@ -643,79 +822,15 @@ class Handler(threading.Thread):
             return self.buildError("no process")
         result = self.buildOK()
         try:
-            str = reduce(lambda x,y: x+y, map(lambda x: chr(x), data))
-            self.target.GetProcess().PutSTDIN(str)
+            self.target.GetProcess().PutSTDIN(bytes(data).decode('latin-1'))
         except Exception as e:
             result = self.buildError("cannot build string to send")
         return result
 
     def handleRequest(self,req):
         command = req['command'];
-        result = None
-        if command == 'ping':
-            result = self.buildOK()
-        elif command == 'prepareExecutable':
-            result = self.prepareExecutable(req['path'], req['is64Bits'], req['cwd'], req['args'])
-        elif command == 'createProcess':
-            result = self.createProcess()
-        elif command == 'attachToProcess':
-            result = self.attachToProcess(req['pid'], req['executable'], req['is64Bits'])
-        elif command == 'detach':
-            result = self.detach()
-        elif command == 'deleteProcess':
-            result = self.deleteProcess()
-        elif command == 'hasProcess':
-            result = self.hasProcess()
-        elif command == 'getProcessState':
-            result = self.getProcessState()
-        elif command == 'continueExecution':
-            result = self.continueExecution()
-        elif command == 'stopExecution':
-            result = self.stopExecution()
-        elif command == 'breakExecution':
-            result = self.breakExecution()
-        elif command == 'getThreadIDList':
-            result = self.getThreadIDList()
-        elif command == 'selectThreadID':
-            result = self.selectThreadID(req['tid'])
-        elif command == 'getRegisters':
-            result = self.getRegisters()
-        elif command == 'setBreakpointAtVirtualAddress':
-            result = self.setBreakpointAtVirtualAddress(req['address'])
-        elif command == 'removeBreakpoint':
-            result = self.removeBreakpoint(req['bkpt_id'])
-        elif command == 'removeAllBreakpoints':
-            result = self.removeAllBreakpoints()
-        elif command == 'stepInstruction':
-            result = self.stepInstruction()
-        elif command == 'stepOver':
-            result = self.stepOver()
-        elif command == 'stepOut':
-            result = self.stepOut()
-        elif command == 'readMemory':
-            result = self.readMemory(req['address'], req['length'])
-        elif command == 'writeByte':
-            result = self.writeByte(req['address'], req['value'])
-        elif command == 'getCallstack':
-            result = self.getCallstack()
-        elif command == 'selectFrame':
-            result = self.selectFrame(req['index'])
-        elif command == 'setRegister':
-            result = self.setRegister(req['register'], req['value'])
-        elif command == 'executeCommand':
-            result = self.executeCommand(req['cli'])
-        elif command == 'completeCommand':
-            result = self.completeCommand(req['cli'], req['pos'])
-        elif command == 'sendToApplication':
-            result = self.sendToApplication(req['data'])
-        elif command == 'moduleCount':
-            return self.moduleCount()
-        elif command == 'moduleAtIndex':
-            return self.moduleAtIndex(req['index'])
-        elif command == 'moduleForFile':
-            return self.moduleForFile(req['file'])
-        elif command == 'connectRemote':
-            return self.connectRemote(req['is64Bits'], req['url'], req['plugin'], req['platform'], req['file'])
+        handler = self._dispatch.get(command)
+        result = handler(req) if handler != None else None
         if result == None:
             result = self.buildError("unknown command '" + command + "'")
         return result
@@ -730,7 +845,7 @@ class Handler(threading.Thread):
 
                 # Decode JSON
                 try:
-                    req = json.loads(line)
+                    req = _loads(line)
                 except ValueError:
                     req = None
 
@@ -764,13 +879,14 @@ if __name__ == "__main__":
     else:
         fd_in = int(sys.argv[1])
         fd_out = int(sys.argv[2])
-        input_fd = os.fdopen(fd_in, 'r')
-        output_fd = os.fdopen(fd_out, 'w')
+        input_fd = os.fdopen(fd_in, 'rb')
+        output_fd = os.fdopen(fd_out, 'wb')
         cmd_mode = False
 
-    print(dir(lldb.SBTarget))
-    print(dir(lldb.SBProcess))
-    print(dir(lldb.SBEvent))
+    if _VERBOSE:
+        print(dir(lldb.SBTarget))
+        print(dir(lldb.SBProcess))
+        print(dir(lldb.SBEvent))
 
     DBG_LOG("\n\n-------------- STARTING --------------\n")
     handler = Handler(input_fd, output_fd, cmd_mode)
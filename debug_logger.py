@@ -11,11 +11,16 @@ def init_logger():
     global logger
     if logger is None:
         logger = logging.getLogger('macdbg_python')
-        logger.setLevel(logging.DEBUG)
+        # MACDBG_LOG_LEVEL (e.g. WARNING) silences the chatty levels. getLevelName only returns a
+        # number for real level names, so anything else falls back to DEBUG
+        level = logging.getLevelName(os.environ.get('MACDBG_LOG_LEVEL', 'DEBUG').upper())
+        if not isinstance(level, int):
+            level = logging.DEBUG
+        logger.setLevel(level)
         
         # Create console handler
         handler = logging.StreamHandler(sys.stderr)
-        handler.setLevel(logging.DEBUG)
+        handler.setLevel(level)
         
         # Create formatter
         formatter = logging.Formatter('[%(asctime)s] [Python] %(levelname)s: %(message)s')
@@ -53,7 +58,7 @@ def log_communication(direction, message):
     """Log communication between Swift and Python"""
     if logger is None:
         init_logger()
-    logger.debug(f"COMM-{direction}: {message}")
+    logger.debug("COMM-%s: %s", direction, message)
 
 def log_python_server(message):
     """Log Python server specific messages"""